@@ -25,6 +25,13 @@
 
 # COMMAND ----------
 
+# Let toPandas() in load_data stream Arrow record batches instead of pickling rows one at a time
+spark.conf.set("spark.sql.execution.arrow.pyspark.enabled", "true")
+spark.conf.set("spark.sql.execution.arrow.pyspark.fallback.enabled", "true")
+spark.conf.set("spark.sql.execution.arrow.maxRecordsPerBatch", 50000)
+
+# COMMAND ----------
+
 # MAGIC %md ### Load the data
 # MAGIC For this example, we will use a new COVID-19 dataset. Run the cell below to create our dataframe **`covid_df`**.
 
@@ -202,10 +209,9 @@ X_train.head()
 from mlflow.tracking.client import MlflowClient
 
 client = MlflowClient()
-try:
-    client.delete_registered_model(f"feature_store_covid_{cleaned_username}") # Deleting model if already created
-except:
-    None
+model_name = f"feature_store_covid_{cleaned_username}"
+if client.search_registered_models(filter_string=f"name = '{model_name}'"):
+    client.delete_registered_model(model_name) # Deleting model if already created
 
 # COMMAND ----------
 
@@ -220,9 +226,11 @@ def train_model(table_name):
     ## fit and log model
     with mlflow.start_run() as run:
 
-        rf = RandomForestRegressor(max_depth=3, n_estimators=20, random_state=42)
-        rf.fit(X_train, y_train)
-        y_pred = rf.predict(X_test)
+        rf = RandomForestRegressor(max_depth=3, n_estimators=20, random_state=42, n_jobs=-1)
+        # The trees work in float32, so hand them float32 up front. X_train itself keeps the
+        # feature table's types, because the logged signature has to match what score_batch looks up
+        rf.fit(X_train.astype("float32"), y_train)
+        y_pred = rf.predict(X_test.astype("float32"))
 
         mlflow.log_metric("mse", mean_squared_error(y_test, y_pred))
         mlflow.log_metric("r2", r2_score(y_test, y_pred))
@@ -234,7 +242,7 @@ def train_model(table_name):
             training_set=training_set,
             registered_model_name=f"feature_store_covid_{cleaned_username}",
             input_example=X_train[:5],
-            signature=infer_signature(X_train, y_train)
+            signature=infer_signature(X_train.head(100), y_train.head(100)) # only the column types matter
         )
     
 train_model(table_name)
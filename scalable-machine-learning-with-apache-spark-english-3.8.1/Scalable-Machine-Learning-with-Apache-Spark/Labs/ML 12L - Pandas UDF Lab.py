@@ -20,36 +20,58 @@
 
 # MAGIC %md
 # MAGIC 
-# MAGIC In the cell below, we train the same model on the same data set as in the lesson and <a href="https://www.mlflow.org/docs/latest/python_api/mlflow.sklearn.html" target="_blank">autolog</a> metrics, parameters, and models to MLflow. 
+# MAGIC In the cell below, we train the same model on the same data set as in the lesson, with the features passed to sklearn as a float32 NumPy array and the trees fit in parallel on the driver's cores, and <a href="https://www.mlflow.org/docs/latest/python_api/mlflow.sklearn.html" target="_blank">autolog</a> metrics, parameters, and models to MLflow. 
 
 # COMMAND ----------
 
 import mlflow.sklearn
+import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from sklearn.model_selection import train_test_split
 
 with mlflow.start_run(run_name="sklearn-random-forest") as run:
-    # Enable autologging 
-    mlflow.sklearn.autolog(log_input_examples=True, log_model_signatures=True, log_models=True)
+    # Enable autologging (the signature is inferred from a few training rows, so we skip the input example)
+    mlflow.sklearn.autolog(log_input_examples=False, log_model_signatures=True, log_models=True)
     
     # Import the data
     df = pd.read_csv(f"{datasets_dir}/airbnb/sf-listings/airbnb-cleaned-mlflow.csv".replace("dbfs:/", "/dbfs/"))
-    X_train, X_test, y_train, y_test = train_test_split(df.drop(["price"], axis=1), df[["price"]].values.ravel(), random_state=42)
+    # Trees split on float32 thresholds anyway, so float32 features halve the bytes moved without changing the model
+    df = df.astype(np.float32)
+    feature_cols = df.drop(columns=["price"]).columns
+
+    # Hand sklearn C-contiguous float32 arrays so fit/predict don't copy and cast them internally
+    X = np.ascontiguousarray(df[feature_cols].to_numpy(dtype=np.float32))
+    y = df["price"].to_numpy(dtype=np.float32)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, random_state=42)
 
     # Create model, train it, and create predictions
-    rf = RandomForestRegressor(n_estimators=100, max_depth=10)
+    # Fit the trees in parallel on all driver cores
+    rf = RandomForestRegressor(n_estimators=100, max_depth=10, n_jobs=-1, random_state=42)
     rf.fit(X_train, y_train)
     predictions = rf.predict(X_test)
 
 # COMMAND ----------
 
 # MAGIC %md Let's convert our Pandas DataFrame to a Spark DataFrame for distributed inference.
+# MAGIC 
+# MAGIC Rather than sending the pandas DataFrame to the JVM in many small pickled partitions, we write it once as a Parquet file in **`working_dir`** and let Spark read that file back in.
 
 # COMMAND ----------
 
-spark_df = spark.createDataFrame(df)
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+def parquet_handoff_to_spark_df(pdf, path=f"{working_dir}/ml12l_airbnb.parquet"):
+    # pyarrow writes the Parquet file in one pass on the driver, then Spark reads it back as a columnar source
+    table = pa.Table.from_pandas(pdf, preserve_index=False)
+    pq.write_table(table, path.replace("dbfs:/", "/dbfs/"))
+    return spark.read.parquet(path)
+
+# Spread the rows over every core for the predict UDF and materialize them once
+spark_df = parquet_handoff_to_spark_df(df).repartition(sc.defaultParallelism * 2).cache()
+spark_df.count()
 
 # COMMAND ----------
 
@@ -77,17 +99,100 @@ predict = mlflow.pyfunc.spark_udf(<FILL_IN>)
 # MAGIC 
 # MAGIC After loading the model using **`mlflow.pyfunc.spark_udf`**, we can now perform model inference at scale.
 # MAGIC 
-# MAGIC In the cell below, fill in the blank to use the **`predict`** function you have defined above to predict the price based on the features.
+# MAGIC In the cell below, fill in the blank to use the **`predict`** function you have defined above to predict the price based on the features. Pack the features into a single **`struct`** column so each Arrow batch reaches the model as one DataFrame.
 
 # COMMAND ----------
 
 # TODO
 
-features = X_train.columns
+from pyspark.sql.functions import struct
+
+features = feature_cols
 display(spark_df.withColumn("prediction", <FILL_IN>))
 
 # COMMAND ----------
 
+# MAGIC %md ### Vectorized UDF with a broadcast model
+# MAGIC 
+# MAGIC Since we still have the trained **`rf`** in memory, we can also broadcast it to the executors and call **`rf.predict`** directly inside a **`pandas_udf`**. The **`struct`** of features arrives as one pandas DataFrame per Arrow batch, which we hand to sklearn as a single contiguous array instead of going through the pyfunc wrapper.
+
+# COMMAND ----------
+
+import copy
+
+from pyspark.sql.functions import pandas_udf
+from pyspark.sql.types import DoubleType
+
+# Every core already runs its own Python worker, so the executors' copy of the forest predicts on one thread
+bc_rf = sc.broadcast(copy.deepcopy(rf).set_params(n_jobs=1))
+
+@pandas_udf(DoubleType())
+def predict_udf(batch: pd.DataFrame) -> pd.Series:
+    X = batch.to_numpy(dtype=np.float32)
+    return pd.Series(bc_rf.value.predict(X))
+
+display(spark_df.withColumn("prediction", predict_udf(struct(*features))))
+
+# COMMAND ----------
+
+# MAGIC %md ### JIT-compiled forest traversal
+# MAGIC 
+# MAGIC For small batches, averaging the 100 trees in Python can cost more than walking the trees themselves. We can copy each tree's node arrays into padded NumPy arrays and walk them with a <a href="https://numba.readthedocs.io/en/stable/user/jit.html" target="_blank">Numba</a> **`@njit`** function. As with the broadcast **`rf`** above, each Python worker already has a core of its own, so the compiled loop stays single-threaded rather than starting a Numba thread pool in every worker.
+
+# COMMAND ----------
+
+from numba import njit
+
+trees = [estimator.tree_ for estimator in rf.estimators_]
+max_nodes = max(tree.node_count for tree in trees)
+
+children_left = np.full((len(trees), max_nodes), -1, dtype=np.int64)
+children_right = np.full((len(trees), max_nodes), -1, dtype=np.int64)
+split_feature = np.zeros((len(trees), max_nodes), dtype=np.int64)
+split_threshold = np.zeros((len(trees), max_nodes), dtype=np.float64)
+leaf_value = np.zeros((len(trees), max_nodes), dtype=np.float64)
+
+for i, tree in enumerate(trees):
+    n = tree.node_count
+    children_left[i, :n] = tree.children_left
+    children_right[i, :n] = tree.children_right
+    split_feature[i, :n] = tree.feature
+    split_threshold[i, :n] = tree.threshold
+    leaf_value[i, :n] = tree.value[:, 0, 0]
+
+@njit
+def forest_predict(X, children_left, children_right, split_feature, split_threshold, leaf_value):
+    n_trees = children_left.shape[0]
+    tree_preds = np.zeros((n_trees, X.shape[0]))
+    for i in range(n_trees):
+        for row in range(X.shape[0]):
+            node = 0
+            while children_left[i, node] != -1:
+                if X[row, split_feature[i, node]] <= split_threshold[i, node]:
+                    node = children_left[i, node]
+                else:
+                    node = children_right[i, node]
+            tree_preds[i, row] = leaf_value[i, node]
+    return tree_preds.sum(axis=0) / n_trees
+
+forest_arrays = (children_left, children_right, split_feature, split_threshold, leaf_value)
+
+# Sanity check against sklearn before using it at scale
+assert np.allclose(forest_predict(X_test, *forest_arrays), rf.predict(X_test))
+
+# COMMAND ----------
+
+bc_forest = sc.broadcast(forest_arrays)
+
+@pandas_udf(DoubleType())
+def predict_numba_udf(batch: pd.DataFrame) -> pd.Series:
+    X = batch.to_numpy(dtype=np.float32)
+    return pd.Series(forest_predict(X, *bc_forest.value))
+
+display(spark_df.withColumn("prediction", predict_numba_udf(struct(*features))))
+
+# COMMAND ----------
+
 # MAGIC %md-sandbox
 # MAGIC &copy; 2022 Databricks, Inc. All rights reserved.<br/>
 # MAGIC Apache, Apache Spark, Spark and the Spark logo are trademarks of the <a href="https://www.apache.org/">Apache Software Foundation</a>.<br/>
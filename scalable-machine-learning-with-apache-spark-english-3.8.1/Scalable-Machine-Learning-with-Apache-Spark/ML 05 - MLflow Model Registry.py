@@ -63,6 +63,8 @@
 # MAGIC 
 # MAGIC   3. Use library-specific autolog calls for each library you use in your code. (e.g. **`mlflow.spark.autolog()`**)
 # MAGIC 
+# MAGIC Autologging writes every parameter, several training metrics, the model and its signature for each run, and each of those is a separate artifact write to DBFS. Since we only need the parameters, a test metric and the model here, we log them explicitly instead.
+# MAGIC 
 # MAGIC Here we are only using numeric features for simplicity of building the random forest.
 
 # COMMAND ----------
@@ -72,18 +74,35 @@ import mlflow.sklearn
 from mlflow.models.signature import infer_signature
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import mean_squared_error
 from sklearn.model_selection import train_test_split
 
-df = pd.read_csv(f"{datasets_dir}/airbnb/sf-listings/airbnb-cleaned-mlflow.csv".replace("dbfs:/", "/dbfs/"))
-X_train, X_test, y_train, y_test = train_test_split(df.drop(["price"], axis=1), df[["price"]].values.ravel(), random_state=42)
+csv_path = f"{datasets_dir}/airbnb/sf-listings/airbnb-cleaned-mlflow.csv".replace("dbfs:/", "/dbfs/")
+
+# Every column in the cleaned file is numeric, so declare the types up front and skip type inference
+with open(csv_path) as f:
+    header = f.readline().strip().split(",")
+tbl = pacsv.read_csv(csv_path, convert_options=pacsv.ConvertOptions(column_types={c: pa.float64() for c in header}))
+df = tbl.to_pandas(split_blocks=True, self_destruct=True)
+del tbl
+
+X_train, X_test, y_train, y_test = train_test_split(df.drop(["price"], axis=1), df["price"].to_numpy(), random_state=42)
+
+# Databricks autologging is on by default, and would log a second copy of the model under the same artifact path
+mlflow.sklearn.autolog(disable=True)
 
 with mlflow.start_run(run_name="LR Model") as run:
-    mlflow.sklearn.autolog(log_input_examples=True, log_model_signatures=True, log_models=True)
     lr = LinearRegression()
     lr.fit(X_train, y_train)
-    signature = infer_signature(X_train, lr.predict(X_train))
+    # The signature only depends on the column types, so a few rows are enough
+    signature = infer_signature(X_train.head(5), lr.predict(X_train.head(5)))
+
+    mlflow.log_params(lr.get_params())
+    mlflow.log_metric("mse", mean_squared_error(y_test, lr.predict(X_test)))
+    mlflow.sklearn.log_model(sk_model=lr, artifact_path="model", signature=signature, input_example=X_train.iloc[:2])
 
 # COMMAND ----------
 
@@ -168,9 +187,8 @@ client.update_model_version(
 
 # COMMAND ----------
 
-import time
-
-time.sleep(10) # In case the registration is still pending
+# Block until the registration has finished; wait_for_model is defined in Classroom-Setup
+wait_for_model(model_details.name, model_details.version)
 
 # COMMAND ----------
 
@@ -209,11 +227,17 @@ model_version_1 = mlflow.pyfunc.load_model(model_version_uri)
 
 # COMMAND ----------
 
-# MAGIC %md Apply the model.
+# MAGIC %md Apply the model. We score in slices of roughly 4MB, so a large test set never has to be converted to the model's input format in one piece.
 
 # COMMAND ----------
 
-model_version_1.predict(X_test)
+import numpy as np
+
+bytes_per_row = X_test.memory_usage(index=False).sum() / len(X_test)
+rows_per_chunk = max(1, int(4 * 1024 * 1024 // bytes_per_row))
+
+np.concatenate([model_version_1.predict(X_test.iloc[i:i + rows_per_chunk])
+                for i in range(0, len(X_test), rows_per_chunk)])
 
 # COMMAND ----------
 
@@ -253,9 +277,7 @@ with mlflow.start_run(run_name="LR Ridge Model") as run:
 
 # COMMAND ----------
 
-import time
-
-time.sleep(10)
+wait_for_model(model_details.name, 2)
 
 client.transition_model_version_stage(
     name=model_details.name,
@@ -305,34 +327,15 @@ client.transition_model_version_stage(
 
 # COMMAND ----------
 
-# MAGIC %md Delete version 1.  
+# MAGIC %md Now clean up. Deleting the registered model also deletes all of its versions, so there is no need to delete them one by one. We only archive the versions that are still in **`Staging`** or **`Production`** first; version 1 was already archived by the transition above.
 # MAGIC 
 # MAGIC <img src="https://files.training.databricks.com/images/icon_note_24.png"/> You cannot delete a model that is not first archived.
 
 # COMMAND ----------
 
-client.delete_model_version(
-    name=model_name,
-    version=1
-)
-
-# COMMAND ----------
-
-# MAGIC %md Archive version 2 of the model too.
-
-# COMMAND ----------
-
-client.transition_model_version_stage(
-    name=model_name,
-    version=2,
-    stage="Archived"
-)
-
-# COMMAND ----------
-
-# MAGIC %md Now delete the entire registered model.
-
-# COMMAND ----------
+for model_version_info in client.search_model_versions(f"name = '{model_name}'"):
+    if model_version_info.current_stage in ("Staging", "Production"):
+        client.transition_model_version_stage(name=model_name, version=model_version_info.version, stage="Archived")
 
 client.delete_registered_model(model_name)
 
@@ -107,11 +107,15 @@ pandas_df.head()
 # MAGIC %md Read in Parquet with pandas API on Spark. You'll notice pandas API on Spark generates an index column for you, like in pandas.
 # MAGIC 
 # MAGIC Pandas API on Spark also supports reading from Delta (**`read_delta`**), but pandas does not support that yet.
+# MAGIC 
+# MAGIC We set the default index type to **`distributed-sequence`** before the first read, so that generating the index does not pull every row into a single partition (see Index Types below).
 
 # COMMAND ----------
 
 import pyspark.pandas as ps
 
+ps.set_option("compute.default_index_type", "distributed-sequence")
+
 df = ps.read_parquet(f"{datasets_dir}/airbnb/sf-listings/sf-listings-2019-03-06-clean.parquet/")
 df.head()
 
@@ -123,9 +127,7 @@ df.head()
 
 # COMMAND ----------
 
-ps.set_option("compute.default_index_type", "distributed-sequence")
-df_dist_sequence = ps.read_parquet(f"{datasets_dir}/airbnb/sf-listings/sf-listings-2019-03-06-clean.parquet/")
-df_dist_sequence.head()
+ps.get_option("compute.default_index_type")
 
 # COMMAND ----------
 
@@ -167,7 +169,10 @@ display(df.to_spark())
 
 # COMMAND ----------
 
-display(spark_df.groupby("property_type").count().orderBy("count", ascending=False))
+from pyspark.sql.functions import desc
+
+# The limit lets Catalyst plan a per-partition top-K (TakeOrderedAndProject) instead of a full global sort
+display(spark_df.groupby("property_type").count().orderBy(desc("count")).limit(20))
 
 # COMMAND ----------
 
@@ -192,6 +197,29 @@ df.plot(kind="hist", x="bedrooms", y="price", bins=200)
 
 # COMMAND ----------
 
+# MAGIC %md For a histogram we only need the bin counts on the driver. We can compute them with a distributed group-by in Spark, so only one row per bin is collected, and plot the result with matplotlib.
+
+# COMMAND ----------
+
+import matplotlib.pyplot as plt
+from pyspark.sql.functions import col, floor, least, lit, max as spark_max, min as spark_min
+
+num_bins = 200
+price_min, price_max = spark_df.select(spark_min("price"), spark_max("price")).first()
+width = (price_max - price_min) / num_bins
+
+bins_pdf = (spark_df
+            .select(least(floor((col("price") - price_min) / width), lit(num_bins - 1)).alias("bin"))
+            .groupBy("bin").count()
+            .toPandas())
+
+plt.bar(price_min + bins_pdf["bin"] * width, bins_pdf["count"], width=width, align="edge")
+plt.xlabel("price")
+plt.ylabel("count")
+plt.show()
+
+# COMMAND ----------
+
 # MAGIC %md ### SQL on pandas API on Spark DataFrames
 
 # COMMAND ----------
@@ -128,12 +128,18 @@ print(f"The area under the ROC curve: {bc_evaluator.evaluate(pred_df):.2f}")
 # MAGIC %md ## Add Hyperparameter Tuning
 # MAGIC 
 # MAGIC Try changing the hyperparameters of the logistic regression model using the cross-validator. By how much can you improve your metrics? 
+# MAGIC 
+# MAGIC The cross-validator refits the model for every fold and parameter combination, so keep the RFormula out of it. Reuse the RFormula model fitted by the pipeline above (**`pipeline_model.stages[0]`**), and cache only the **`features`** and **`label`** columns it produces. Then cross-validate **`lr`** on that cached DataFrame, and encode **`test_df`** once with the same RFormula model before predicting.
 
 # COMMAND ----------
 
 # TODO
 from pyspark.ml.tuning import ParamGridBuilder
 from pyspark.ml.tuning import CrossValidator
+import mlflow.pyspark.ml
+
+# Databricks autologging would log a run for each of the 18 cross-validation fits, so keep it off while cross-validating
+mlflow.pyspark.ml.autolog(disable=True)
 
 param_grid = <FILL_IN>
 
@@ -141,10 +147,15 @@ evaluator = <FILL_IN>
 
 cv = <FILL_IN>
 
-pipeline = <FILL_IN>
+r_formula_model = <FILL_IN>
+encoded_train_df = <FILL_IN>
+
+cv_model = <FILL_IN>
 
-pipeline_model = <FILL_IN>
+# Turn autologging back on for the Super Bonus below
+mlflow.pyspark.ml.autolog()
 
+encoded_test_df = <FILL_IN>
 pred_df = <FILL_IN>
 
 # COMMAND ----------
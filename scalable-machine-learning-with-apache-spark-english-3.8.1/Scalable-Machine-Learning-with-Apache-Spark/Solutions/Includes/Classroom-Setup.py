@@ -93,6 +93,32 @@ init_mlflow_as_job()
 
 # COMMAND ----------
 
+# Used by the model registry notebook & lab to block until a model version is ready, backing off exponentially between polls
+def wait_for_model(model_name, version, stage="None", status="READY", timeout=300):
+  import time
+  from mlflow.tracking.client import MlflowClient
+
+  client = MlflowClient()
+  last_stage = "unknown"
+  last_status = "unknown"
+  delay = 0.2
+  elapsed = 0
+
+  while elapsed < timeout:
+    model_version_details = client.get_model_version(name=model_name, version=version)
+    last_stage = str(model_version_details.current_stage)
+    last_status = str(model_version_details.status)
+    if last_status == str(status) and last_stage == str(stage):
+      return
+
+    time.sleep(delay)
+    elapsed += delay
+    delay = min(delay * 2, 5.0)
+
+  raise Exception(f"The model {model_name} v{version} was not {status} after {timeout} seconds: {last_status}/{last_stage}")
+
+# COMMAND ----------
+
 def untilStreamIsReady(name):
   queries = list(filter(lambda query: query.name == name, spark.streams.active))
 
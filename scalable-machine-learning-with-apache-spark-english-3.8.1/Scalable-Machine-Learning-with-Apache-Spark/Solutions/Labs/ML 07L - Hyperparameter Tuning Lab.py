@@ -24,6 +24,13 @@
 
 # COMMAND ----------
 
+# The Airbnb dataset is small, so a handful of shuffle partitions (coalesced further by AQE) avoids scheduling hundreds of tiny tasks
+spark.conf.set("spark.sql.shuffle.partitions", "8")
+spark.conf.set("spark.sql.adaptive.enabled", "true")
+spark.conf.set("spark.sql.adaptive.coalescePartitions.enabled", "true")
+
+# COMMAND ----------
+
 # MAGIC %md ## From Regression to Classification
 # MAGIC 
 # MAGIC In this case, we'll turn the Airbnb housing dataset into a classification problem to **classify between high and low price listings.**  Our **`class`** column will be:<br><br>
@@ -34,7 +41,6 @@
 # COMMAND ----------
 
 from pyspark.ml.feature import StringIndexer, VectorAssembler
-from pyspark.ml import Pipeline
 from pyspark.sql.functions import col
 
 file_path = f"{datasets_dir}/airbnb/sf-listings/sf-listings-2019-03-06-clean.delta/"
@@ -47,14 +53,21 @@ airbnb_df = (spark
             .drop("price")
            )
 
+categorical_cols = [field for (field, dataType) in airbnb_df.dtypes if dataType == "string"]
+index_output_cols = [x + "Index" for x in categorical_cols]
+numeric_cols = [field for (field, dataType) in airbnb_df.dtypes if ((dataType == "double") & (field != "priceClass"))]
+
 train_df, test_df = airbnb_df.randomSplit([.8, .2], seed=42)
 
-categorical_cols = [field for (field, dataType) in train_df.dtypes if dataType == "string"]
-index_output_cols = [x + "Index" for x in categorical_cols]
+# Keep only the columns the pipeline uses; projecting after the split leaves the split itself unchanged
+pipeline_cols = [*categorical_cols, *numeric_cols, "priceClass"]
+train_df = train_df.select(*pipeline_cols).cache()
+train_df.count()
+test_df = test_df.select(*pipeline_cols)
 
-string_indexer = StringIndexer(inputCols=categorical_cols, outputCols=index_output_cols, handleInvalid="skip")
+# Keep unseen categories in their own index rather than dropping those rows
+string_indexer = StringIndexer(inputCols=categorical_cols, outputCols=index_output_cols, handleInvalid="keep")
 
-numeric_cols = [field for (field, dataType) in train_df.dtypes if ((dataType == "double") & (field != "priceClass"))]
 assembler_inputs = index_output_cols + numeric_cols
 vec_assembler = VectorAssembler(inputCols=assembler_inputs, outputCol="features")
 
@@ -70,16 +83,18 @@ vec_assembler = VectorAssembler(inputCols=assembler_inputs, outputCol="features"
 
 # MAGIC %md ## Random Forest
 # MAGIC 
-# MAGIC Create a Random Forest classifer called **`rf`** with the **`labelCol=priceClass`**, **`maxBins=40`**, and **`seed=42`** (for reproducibility).
+# MAGIC Create a Random Forest classifer called **`rf`** with the **`labelCol=priceClass`**, **`maxBins=40`**, **`featureSubsetStrategy="sqrt"`**, and **`seed=42`** (for reproducibility).
 # MAGIC 
 # MAGIC It's under **`pyspark.ml.classification.RandomForestClassifier`** in Python.
+# MAGIC 
+# MAGIC <img src="https://files.training.databricks.com/images/icon_note_24.png"/> The VectorAssembler carries the StringIndexer's nominal attributes (and their number of values) into the **`features`** column metadata, so the random forest knows which features are categorical without having to infer it on every fit.
 
 # COMMAND ----------
 
 # ANSWER
 from pyspark.ml.classification import RandomForestClassifier
 
-rf = RandomForestClassifier(labelCol="priceClass", maxBins=40, seed=42)
+rf = RandomForestClassifier(labelCol="priceClass", maxBins=40, featureSubsetStrategy="sqrt", seed=42)
 
 # COMMAND ----------
 
@@ -126,33 +141,42 @@ evaluator = BinaryClassificationEvaluator(labelCol="priceClass", metricName="are
 
 # COMMAND ----------
 
-# MAGIC %md ## Cross Validation
+# MAGIC %md ## Train Validation Split
 # MAGIC 
-# MAGIC We are going to do 3-Fold cross-validation, with **`parallelism`**=4, and set the **`seed`**=42 on the cross-validator for reproducibility.
+# MAGIC 3-fold cross-validation over our 3x3 grid would fit 27 random forests, dominated by the **`numTrees=100, maxDepth=10`** cells. Instead, we are going to use a <a href="https://spark.apache.org/docs/latest/api/python/reference/api/pyspark.ml.tuning.TrainValidationSplit.html" target="_blank">TrainValidationSplit</a>, which fits each combination once (9 fits) on a single train/validation split. Use **`trainRatio`**=0.8 and **`parallelism`**=**`len(param_grid)`** so all 9 fits can run at once, and set the **`seed`**=42 for reproducibility.
 # MAGIC 
-# MAGIC Put the Random Forest in the CV to speed up the <a href="https://spark.apache.org/docs/latest/api/python/reference/api/pyspark.ml.tuning.CrossValidator.html?highlight=crossvalidator#pyspark.ml.tuning.CrossValidator" target="_blank">cross validation</a> (as opposed to the pipeline in the CV).
+# MAGIC Put the Random Forest in the TrainValidationSplit to speed up the tuning (as opposed to the pipeline in the TrainValidationSplit).
 
 # COMMAND ----------
 
 # ANSWER
-from pyspark.ml.tuning import CrossValidator
+from pyspark.ml.tuning import TrainValidationSplit
 
-cv = CrossValidator(estimator=rf, evaluator=evaluator, estimatorParamMaps=param_grid,
-                    numFolds=3, parallelism=4, seed=42)
+tvs = TrainValidationSplit(estimator=rf, evaluator=evaluator, estimatorParamMaps=param_grid,
+                           trainRatio=0.8, parallelism=len(param_grid), seed=42)
 
 # COMMAND ----------
 
 # MAGIC %md ## Pipeline
 # MAGIC 
-# MAGIC Let's fit the pipeline with our cross validator to our training data (this may take a few minutes).
+# MAGIC Let's fit the pipeline with our train validation split to our training data (this may take a few minutes).
+# MAGIC 
+# MAGIC The StringIndexer and VectorAssembler don't depend on the hyperparameters, so we fit them once and checkpoint their output for all 9 random forest fits. We then combine the fitted stages and the tuned model into a single **`PipelineModel`**.
 
 # COMMAND ----------
 
-stages = [string_indexer, vec_assembler, cv]
+from pyspark.ml import PipelineModel
 
-pipeline = Pipeline(stages=stages)
+# Fit the label dictionaries once; SparkML ships them to the executors with the model
+string_indexer_model = string_indexer.fit(train_df)
+prep_model = PipelineModel(stages=[string_indexer_model, vec_assembler])
+# Checkpointing truncates the lineage, so each fit starts from the prepared features rather than the full DAG.
+# The directory lives outside working_dir, which the model save below overwrites.
+spark.sparkContext.setCheckpointDir(f"{userhome}/ml07l_checkpoints")
+prepared_df = prep_model.transform(train_df).select("features", "priceClass").checkpoint()
 
-pipeline_model = pipeline.fit(train_df)
+tvs_model = tvs.fit(prepared_df)
+pipeline_model = PipelineModel(stages=prep_model.stages + [tvs_model])
 
 # COMMAND ----------
 
@@ -162,10 +186,10 @@ pipeline_model = pipeline.fit(train_df)
 
 # COMMAND ----------
 
-cv_model = pipeline_model.stages[-1]
-rf_model = cv_model.bestModel
+tvs_model = pipeline_model.stages[-1]
+rf_model = tvs_model.bestModel
 
-# list(zip(cv_model.getEstimatorParamMaps(), cv_model.avgMetrics))
+# list(zip(tvs_model.getEstimatorParamMaps(), tvs_model.validationMetrics))
 
 print(rf_model.explainParams())
 
@@ -175,10 +199,16 @@ print(rf_model.explainParams())
 
 # COMMAND ----------
 
+import numpy as np
 import pandas as pd
 
-pandas_df = pd.DataFrame(list(zip(vec_assembler.getInputCols(), rf_model.featureImportances)), columns=["feature", "importance"])
-top_features = pandas_df.sort_values(["importance"], ascending=False)
+imp = rf_model.featureImportances.toArray()
+cols = np.asarray(vec_assembler.getInputCols())
+# Partially select the top k in O(n), then sort only those k
+k = min(20, len(imp))
+idx = np.argpartition(imp, -k)[-k:]
+idx = idx[np.argsort(imp[idx])[::-1]]
+top_features = pd.DataFrame({"feature": cols[idx], "importance": imp[idx]})
 top_features
 
 # COMMAND ----------
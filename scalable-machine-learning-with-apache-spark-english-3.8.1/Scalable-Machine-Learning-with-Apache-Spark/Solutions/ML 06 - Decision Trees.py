@@ -26,6 +26,10 @@ file_path = f"{datasets_dir}/airbnb/sf-listings/sf-listings-2019-03-06-clean.del
 airbnb_df = spark.read.format("delta").load(file_path)
 train_df, test_df = airbnb_df.randomSplit([.8, .2], seed=42)
 
+# Spread the training rows over 3x the available cores so tree training uses the whole cluster
+train_df = train_df.repartition(sc.defaultParallelism * 3).cache()
+train_df.count()
+
 # COMMAND ----------
 
 # MAGIC %md ## How to Handle Categorical Features?
@@ -41,7 +45,8 @@ train_df, test_df = airbnb_df.randomSplit([.8, .2], seed=42)
 
 from pyspark.ml.feature import StringIndexer
 
-categorical_cols = [field for (field, dataType) in train_df.dtypes if dataType == "string"]
+dtypes = dict(train_df.dtypes)
+categorical_cols = [field for (field, dataType) in dtypes.items() if dataType == "string"]
 index_output_cols = [x + "Index" for x in categorical_cols]
 
 string_indexer = StringIndexer(inputCols=categorical_cols, outputCols=index_output_cols, handleInvalid="skip")
@@ -57,7 +62,7 @@ string_indexer = StringIndexer(inputCols=categorical_cols, outputCols=index_outp
 from pyspark.ml.feature import VectorAssembler
 
 # Filter for just numeric columns (and exclude price, our label)
-numeric_cols = [field for (field, dataType) in train_df.dtypes if ((dataType == "double") & (field != "price"))]
+numeric_cols = [field for (field, dataType) in dtypes.items() if ((dataType == "double") & (field != "price"))]
 # Combine output of StringIndexer defined above and numeric columns
 assembler_inputs = index_output_cols + numeric_cols
 vec_assembler = VectorAssembler(inputCols=assembler_inputs, outputCol="features")
@@ -134,7 +139,10 @@ pipeline_model = pipeline.fit(train_df)
 # COMMAND ----------
 
 dt_model = pipeline_model.stages[-1]
-display(dt_model)
+print(f"depth={dt_model.depth}, numNodes={dt_model.numNodes}")
+
+# Rendering the whole tree grows with the number of nodes, so only print the start of it
+# print(dt_model.toDebugString[:2000])
 
 # COMMAND ----------
 
@@ -150,7 +158,7 @@ dt_model.featureImportances
 
 import pandas as pd
 
-features_df = pd.DataFrame(list(zip(vec_assembler.getInputCols(), dt_model.featureImportances)), columns=["feature", "importance"])
+features_df = pd.DataFrame({"feature": vec_assembler.getInputCols(), "importance": dt_model.featureImportances.toArray()})
 features_df
 
 # COMMAND ----------
@@ -166,7 +174,7 @@ features_df
 dbutils.widgets.text("top_k", "5")
 top_k = int(dbutils.widgets.get("top_k"))
 
-top_features = features_df.sort_values(["importance"], ascending=False)[:top_k]["feature"].values
+top_features = features_df.nlargest(top_k, "importance")["feature"].to_numpy()
 print(top_features)
 
 # COMMAND ----------
@@ -203,6 +211,10 @@ from pyspark.ml.evaluation import RegressionEvaluator
 
 regression_evaluator = RegressionEvaluator(predictionCol="prediction", labelCol="price", metricName="rmse")
 
+# Materialize the predictions once so the rmse and r2 evaluations don't each re-run the pipeline
+pred_df = pred_df.select("price", "prediction").cache()
+pred_df.count()
+
 rmse = regression_evaluator.evaluate(pred_df)
 r2 = regression_evaluator.setMetricName("r2").evaluate(pred_df)
 print(f"RMSE is {rmse}")
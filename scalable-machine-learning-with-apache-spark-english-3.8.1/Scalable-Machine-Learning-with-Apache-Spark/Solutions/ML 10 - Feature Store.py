@@ -24,7 +24,19 @@
 
 # COMMAND ----------
 
-from pyspark.sql.functions import monotonically_increasing_id, lit, expr, rand
+# Let toPandas() in load_data stream Arrow record batches instead of pickling rows one at a time
+spark.conf.set("spark.sql.execution.arrow.pyspark.enabled", "true")
+spark.conf.set("spark.sql.execution.arrow.pyspark.fallback.enabled", "true")
+spark.conf.set("spark.sql.execution.arrow.maxRecordsPerBatch", 50000)
+
+# Set the debug widget to false (e.g. for scheduled runs) to skip the intermediate previews below
+dbutils.widgets.dropdown("debug", "true", ["true", "false"])
+DEBUG = dbutils.widgets.get("debug") == "true"
+
+# COMMAND ----------
+
+from pyspark import StorageLevel
+from pyspark.sql.functions import monotonically_increasing_id, col, lit, expr, rand
 import uuid
 from databricks import feature_store
 from pyspark.sql.types import StringType, DoubleType
@@ -43,7 +55,11 @@ from sklearn.metrics import mean_squared_error, r2_score
 # COMMAND ----------
 
 file_path = f"{datasets_dir}/airbnb/sf-listings/sf-listings-2019-03-06-clean.delta/"
-airbnb_df = spark.read.format("delta").load(file_path).coalesce(1).withColumn("index", monotonically_increasing_id())
+raw_df = spark.read.format("delta").load(file_path)
+
+# The ids stay unique without collapsing the data into a single partition; caching pins them for every action below
+airbnb_df = raw_df.withColumn("index", monotonically_increasing_id()).cache()
+airbnb_df.count()
 display(airbnb_df)
 
 # COMMAND ----------
@@ -152,11 +168,13 @@ fs.create_table(
 
 # COMMAND ----------
 
-fs.get_table(table_name).path_data_sources
+# Fetch the table metadata once and reuse it for both fields
+feature_table_info = fs.get_table(table_name)
+feature_table_info.path_data_sources
 
 # COMMAND ----------
 
-fs.get_table(table_name).description
+feature_table_info.description
 
 # COMMAND ----------
 
@@ -175,8 +193,13 @@ fs.get_table(table_name).description
 # COMMAND ----------
 
 ## inference data -- index (key), price (target) and a online feature (make up a fictional column - diff of review score in a month) 
-inference_data_df = airbnb_df.select("index", "price", (rand() * 0.5-0.25).alias("score_diff_from_last_month"))
-display(inference_data_df)
+# Training and batch scoring both read this, so seed rand() and materialize it once to keep the values consistent
+inference_data_df = (airbnb_df
+                     .select("index", "price", (rand(seed=42) * 0.5-0.25).alias("score_diff_from_last_month"))
+                     .persist(StorageLevel.MEMORY_AND_DISK))
+inference_data_df.count()
+if DEBUG:
+    display(inference_data_df)
 
 # COMMAND ----------
 
@@ -214,10 +237,9 @@ from mlflow.tracking.client import MlflowClient
 
 client = MlflowClient()
 
-try:
-    client.delete_registered_model(f"feature_store_airbnb_{cleaned_username}") # Deleting model if already created
-except:
-    None
+model_name = f"feature_store_airbnb_{cleaned_username}"
+if client.search_registered_models(filter_string=f"name = '{model_name}'"):
+    client.delete_registered_model(model_name) # Deleting model if already created
 
 # COMMAND ----------
 
@@ -228,9 +250,11 @@ def train_model(X_train, X_test, y_train, y_test, training_set, fs):
     ## fit and log model
     with mlflow.start_run() as run:
 
-        rf = RandomForestRegressor(max_depth=3, n_estimators=20, random_state=42)
-        rf.fit(X_train, y_train)
-        y_pred = rf.predict(X_test)
+        rf = RandomForestRegressor(max_depth=3, n_estimators=20, random_state=42, n_jobs=-1)
+        # The trees work in float32, so hand them float32 up front. X_train itself keeps the
+        # feature table's types, because the logged signature has to match what score_batch looks up
+        rf.fit(X_train.astype("float32"), y_train)
+        y_pred = rf.predict(X_test.astype("float32"))
 
         mlflow.log_metric("test_mse", mean_squared_error(y_test, y_pred))
         mlflow.log_metric("test_r2_score", r2_score(y_test, y_pred))
@@ -242,10 +266,14 @@ def train_model(X_train, X_test, y_train, y_test, training_set, fs):
             training_set=training_set,
             registered_model_name=f"feature_store_airbnb_{cleaned_username}",
             input_example=X_train[:5],
-            signature=infer_signature(X_train, y_train)
+            signature=infer_signature(X_train.head(100), y_train.head(100)) # only the column types matter
         )
+    return rf
+
+rf = train_model(X_train, X_test, y_train, y_test, training_set, fs)
 
-train_model(X_train, X_test, y_train, y_test, training_set, fs)
+# Only the training run needs autologging, so remove the sklearn patches before scoring
+mlflow.sklearn.autolog(disable=True)
 
 # COMMAND ----------
 
@@ -282,31 +310,65 @@ train_model(X_train, X_test, y_train, y_test, training_set, fs)
 
 ## For sake of simplicity, we will just predict on the same inference_data_df
 batch_input_df = inference_data_df.drop("price") # Exclude true label
+
 predictions_df = fs.score_batch(f"models:/feature_store_airbnb_{cleaned_username}/1", 
                                   batch_input_df, result_type="double")
 display(predictions_df)
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC All of the features here are numeric, so we can also do the lookup join ourselves and score with a **`pandas_udf`**, the same way as in the Pandas UDF lab. A single-threaded copy of the fitted **`rf`** is broadcast once, and the **`struct`** of features in each Arrow batch (sized by **`spark.sql.execution.arrow.maxRecordsPerBatch`**) goes through a single vectorized **`predict`** call instead of the pyfunc wrapper.
+
+# COMMAND ----------
+
+import copy
+
+import numpy as np
+import pandas as pd
+from pyspark.sql.functions import pandas_udf, struct
+
+feature_cols = list(X_train.columns)
+# Every core already runs its own Python worker, so the executors' copy of the forest predicts on one thread
+bc_rf = sc.broadcast(copy.deepcopy(rf).set_params(n_jobs=1))
+
+@pandas_udf(DoubleType())
+def predict_udf(batch: pd.DataFrame) -> pd.Series:
+    X = batch.to_numpy(dtype=np.float32)
+    return pd.Series(bc_rf.value.predict(X))
+
+features_df = batch_input_df.join(fs.read_table(name=table_name), "index")
+display(features_df.withColumn("prediction", predict_udf(struct(*feature_cols))))
+
+# COMMAND ----------
+
 # MAGIC %md 
 # MAGIC ### Overwrite feature table
 # MAGIC Lastly, we'll condense some of the review columns and update the feature table: we'll do this by calculating the average review score for each listing.
+# MAGIC 
+# MAGIC We build the average from typed **`Column`** arithmetic rather than a SQL string, so on a Photon-enabled cluster the projection can run in Photon. You can check this by looking for **`PhotonProject`** instead of **`Project`** in the query plan. Without Photon, the same expression still goes through whole-stage codegen.
 
 # COMMAND ----------
 
 ## select numeric features and aggregate the review scores
 review_columns = ["review_scores_accuracy", "review_scores_cleanliness", "review_scores_checkin", 
                  "review_scores_communication", "review_scores_location", "review_scores_value"]
+from functools import reduce
+from operator import add
+
 @feature_table
 def select_numeric_features(data):
+    # Build the sum from typed columns rather than a SQL string that has to be parsed
+    avg_review_score = reduce(add, [col(c) for c in review_columns]) / lit(len(review_columns))
     result = (data.select(["index"] + numeric_cols)
-              .withColumn("average_review_score", expr("+".join(review_columns)) / lit(len(review_columns)))
+              .withColumn("average_review_score", avg_review_score)
               .drop(*review_columns)
              )
     return result
 
 condensed_review_df = select_numeric_features(airbnb_df)
-display(condensed_review_df)
+if DEBUG:
+    display(condensed_review_df)
 
 # COMMAND ----------
 
@@ -321,6 +383,9 @@ fs.write_table(
     mode="overwrite"
 )
 
+# Compact the rewritten files and cluster them on the lookup key
+spark.sql(f"OPTIMIZE {table_name} ZORDER BY (index)")
+
 # COMMAND ----------
 
 # MAGIC %md 
@@ -345,13 +410,21 @@ fs.write_table(
 
 # COMMAND ----------
 
-# Displays most recent table
-display(fs.read_table(name=table_name))
+# Displays most recent table; only 20 rows are brought back to the driver
+fs.read_table(name=table_name).limit(20).toPandas()
 
 # COMMAND ----------
 
 # MAGIC %md If you need to use the features for real-time serving, you can publish your features to an <a href="https://docs.databricks.com/applications/machine-learning/feature-store.html#publish-features-to-an-online-feature-store" target="_blank">online store</a>.
 # MAGIC 
+# MAGIC Per-request lookups then read a low-latency key-value store instead of scanning the Delta table. **`fs.score_batch`** always reads the offline table, so this only helps models served online. Publishing needs an online store and credentials set up by your workspace admin, so it is not run in this lesson. For example, with DynamoDB:
+# MAGIC 
+# MAGIC **`
+# MAGIC from databricks.feature_store.online_store_spec import AmazonDynamoDBSpec
+# MAGIC online_store = AmazonDynamoDBSpec(region="us-west-2", read_secret_prefix="<scope>/<prefix>", write_secret_prefix="<scope>/<prefix>")
+# MAGIC fs.publish_table(name=table_name, online_store=online_store, mode="merge")
+# MAGIC `**
+# MAGIC 
 # MAGIC We can perform control who has permissions to the feature table on the UI.
 # MAGIC 
 # MAGIC To delete the table, use the **`delete`** button on the UI. **You need to delete the delta table from database as well.**